@@ -32,14 +32,43 @@ Calibration JSON example:
 import os
 import re
 import json
+import hashlib
+import tempfile
+import math
+import struct
 import argparse
 import numpy as np
 import pandas as pd
+import matplotlib
+matplotlib.use('Agg')  # plots are only saved to disk, no GUI backend needed
 import matplotlib.pyplot as plt
 import cv2
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from fnmatch import fnmatch
+from functools import partial
 from glob import glob
 from skimage import color
 
+try:
+    from turbojpeg import TurboJPEG
+    _tj = TurboJPEG()
+except (ImportError, RuntimeError, OSError):
+    _tj = None
+
+try:
+    import numba
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+# iMCU (width, height) in pixels for each TurboJPEG chroma subsampling (TJSAMP_444 ... TJSAMP_441)
+MCU_SIZES = {0: (8,8), 1: (16,8), 2: (16,16), 3: (8,8), 4: (8,16), 5: (32,8), 6: (8,32)}
+
+_NUM_RE = re.compile(r"(\d+(?:\.\d+)?)")
+
+# file reads and JPEG decoding release the GIL, so images are processed in a thread pool
+MAX_WORKERS = min(8, os.cpu_count() or 1)
+
 
 def parse_roi(arg):
     try:
@@ -51,14 +80,188 @@ def parse_roi(arg):
         raise argparse.ArgumentTypeError("ROI must be x,y,width,height with integers")
 
 
-def numerical_sort_key(path):
-    fname = os.path.basename(path)
-    match = re.search(r"(\d+(?:\.\d+)?)", fname)
+def filename_number(name):
+    match = _NUM_RE.search(name)
     return float(match.group(1)) if match else 0
 
 
+def list_images(folder):
+    # one directory scan, sorted by the number in each filename
+    entries = []
+    for e in os.scandir(folder):
+        # fnmatch keeps glob's per-platform case rules (IMG_0001.JPG matches on Windows)
+        if fnmatch(e.name, '*.jpg') and not e.name.startswith('.') and e.is_file():
+            entries.append((filename_number(e.name), e.path))
+    entries.sort()
+    return [p for _, p in entries]
+
+
+def jpeg_orientation(data):
+    # EXIF Orientation tag (0x0112) of a JPEG; 1 (upright) when there is none, None if the EXIF is unreadable
+    if data[:2] != b'\xff\xd8':
+        return None
+    try:
+        i = 2
+        while i + 4 <= len(data) and data[i] == 0xFF:
+            marker = data[i+1]
+            if marker in (0xD9, 0xDA):  # end of image / start of scan: no more metadata
+                break
+            size, = struct.unpack('>H', data[i+2:i+4])
+            if marker == 0xE1 and data[i+4:i+10] == b'Exif\x00\x00':
+                tiff = data[i+10:i+2+size]
+                endian = '<' if tiff[:2] == b'II' else '>'
+                ifd, = struct.unpack(endian+'I', tiff[4:8])
+                count, = struct.unpack(endian+'H', tiff[ifd:ifd+2])
+                for k in range(count):
+                    entry = ifd + 2 + 12*k
+                    tag, = struct.unpack(endian+'H', tiff[entry:entry+2])
+                    if tag == 0x0112:
+                        return struct.unpack(endian+'H', tiff[entry+8:entry+10])[0]
+                return 1
+            i += 2 + size
+    except struct.error:
+        return None
+    return 1
+
+
+def load_regions(path, rois):
+    # read the file bytes separately from the decode so disk reads overlap across worker threads
+    with open(path, 'rb') as f:
+        data = f.read()
+    # cv2 applies the EXIF rotation but TurboJPEG does not, so rotated images always take the cv2 path
+    if _tj is not None and jpeg_orientation(data) == 1:
+        img = None
+        try:
+            width, height, subsample = _tj.decode_header(data)[:3]
+            mcu = MCU_SIZES.get(subsample)
+            if mcu is not None:
+                # decode only the window covering all ROIs, snapped outward to the iMCU grid and padded by
+                # one iMCU so chroma upsampling at the ROI borders sees the real neighbouring pixels
+                mw, mh = mcu
+                x0 = max(0, min(x for x,y,w,h in rois) // mw * mw - mw)
+                y0 = max(0, min(y for x,y,w,h in rois) // mh * mh - mh)
+                x1 = min(width, -(-max(x+w for x,y,w,h in rois) // mw) * mw + mw)
+                y1 = min(height, -(-max(y+h for x,y,w,h in rois) // mh) * mh + mh)
+                img = _tj.decode(_tj.crop(data, x0, y0, x1-x0, y1-y0))
+        except (OSError, ValueError):
+            pass  # window outside the frame or unsupported JPEG; fall back to a full decode
+        # some PyTurboJPEG versions move the origin or drop partial edge iMCUs; only trust an exact window
+        if img is not None and img.shape[:2] == (y1-y0, x1-x0):
+            return check_regions(path, rois, [img[y-y0:y-y0+h, x-x0:x-x0+w] for x,y,w,h in rois])
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    return check_regions(path, rois, [img[y:y+h, x:x+w] for x,y,w,h in rois])
+
+
+def check_regions(path, rois, regions):
+    # slicing silently clips an ROI at the frame edge; refuse it instead of averaging a partial window
+    for roi, region in zip(rois, regions):
+        if region.shape[:2] != (roi[3], roi[2]):
+            raise ValueError(f"ROI {tuple(roi)} extends outside the image {path}")
+    return regions
+
+
+def channel_means(region):
+    # cv2.mean sums uint8 pixels without a float64 copy; keeps the input channel order
+    return np.array(cv2.mean(region)[:3])
+
+
+def calibration_means(path, target_roi, background_roi):
+    target, bg = load_regions(path, (target_roi, background_roi))
+    # convert only the ROI pixels to RGB; cvtColor returns dense copies, not strided views of the frame
+    target = cv2.cvtColor(target, cv2.COLOR_BGR2RGB)
+    bg     = cv2.cvtColor(bg, cv2.COLOR_BGR2RGB)
+    # flatten to (N,3) so rgb2lab runs on one contiguous pixel list; LAB is averaged per pixel as before.
+    # float32 is plenty for 8-bit input and halves the memory traffic of the conversion
+    lab = color.rgb2lab(target.reshape(-1,3).astype(np.float32) * (1.0/255.0))
+    return channel_means(target), channel_means(bg), lab.mean(axis=0, dtype=np.float64)
+
+
+def region_pixels(path, roi):
+    region, = load_regions(path, (roi,))
+    return cv2.cvtColor(region, cv2.COLOR_BGR2RGB)
+
+
+def load_roi_stack(paths, roi, cache_dir=None, max_workers=MAX_WORKERS):
+    # (N,h,w,3) uint8 stack of the RGB ROIs, written into a disk-backed memmap so peak RAM does not grow
+    # with N; cached as .npy keyed by the files' mtimes/sizes, the ROI and the JPEG decoder in use
+    x,y,w,h = roi
+    if not paths:
+        return np.zeros((0,h,w,3), np.uint8)
+    if cache_dir:
+        stats = [(os.path.abspath(p), os.stat(p).st_mtime_ns, os.stat(p).st_size) for p in paths]
+        backend = 'turbojpeg' if _tj is not None else 'cv2'
+        key = hashlib.sha1(repr((tuple(roi), backend, stats)).encode()).hexdigest()
+        cache_path = os.path.join(cache_dir, f"{key}.npy")
+        if os.path.exists(cache_path):
+            return np.load(cache_path, mmap_mode='r')
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = os.path.join(cache_dir, f"{key}.{os.getpid()}.tmp.npy")
+        stack = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint8, shape=(len(paths),h,w,3))
+    else:
+        stack = np.memmap(tempfile.TemporaryFile(), dtype=np.uint8, mode='w+', shape=(len(paths),h,w,3))
+
+    def fill(i, path):
+        stack[i] = region_pixels(path, roi)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as ex:
+            list(ex.map(fill, range(len(paths)), paths))
+    except BaseException:
+        if cache_dir:
+            # do not leave a half-written stack behind in the cache
+            del stack
+            os.remove(tmp_path)
+        raise
+
+    if cache_dir:
+        # release the write mapping before moving the file into place, then reopen it read-only
+        stack.flush()
+        del stack
+        os.replace(tmp_path, cache_path)
+        return np.load(cache_path, mmap_mode='r')
+    return stack
+
+
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def reduce_and_calibrate(stack, channel, slope, intercept, is_dye4):
+        # one pass over the (N,h,w,3) uint8 stack: per-image RGB means plus the calibrated concentration
+        n, h, w, _ = stack.shape
+        means = np.empty((n,3))
+        concs = np.empty(n)
+        # -log(m/i)/s == (log(i) - log(m)) * (1/s); hoist the per-folder constants out of the loop
+        inv_slope = 1.0/slope
+        log_i = math.log(intercept)
+        for i in prange(n):
+            s0 = 0; s1 = 0; s2 = 0
+            for y in range(h):
+                for x in range(w):
+                    s0 += stack[i,y,x,0]
+                    s1 += stack[i,y,x,1]
+                    s2 += stack[i,y,x,2]
+            means[i,0] = s0/(h*w)
+            means[i,1] = s1/(h*w)
+            means[i,2] = s2/(h*w)
+            m = means[i,channel]
+            if is_dye4:
+                concs[i] = (log_i - math.log(m)) * inv_slope
+            else:
+                concs[i] = (intercept - m) * inv_slope
+        return means, concs
+else:
+    def reduce_and_calibrate(stack, channel, slope, intercept, is_dye4):
+        means = stack.mean(axis=(1,2))
+        col = means[:, channel]
+        inv_slope = 1.0/slope
+        if is_dye4:
+            concs = (np.log(intercept) - np.log(col)) * inv_slope
+        else:
+            concs = (intercept - col) * inv_slope
+        return means, concs
+
+
 def calibrate(args):
-    image_paths = sorted(glob(os.path.join(args.image_folder, '*.jpg')), key=numerical_sort_key)
+    image_paths = list_images(args.image_folder)
     if not image_paths:
         raise FileNotFoundError("No .jpg images found in calibration folder.")
 
@@ -71,93 +274,101 @@ def calibrate(args):
     # create output folder
     os.makedirs(args.output_folder, exist_ok=True)
 
-    for i, path in enumerate(image_paths):
-        img = cv2.imread(path)
-        img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        tx, ty, tw, th = args.target_roi
-        bx, by, bw, bh = args.background_roi
-        target = img_rgb[ty:ty+th, tx:tx+tw]
-        bg     = img_rgb[by:by+bh, bx:bx+bw]
-        rgb_data[i] = target.mean(axis=(0,1))
-        rgb_bg[i]   = bg.mean(axis=(0,1))
-        lab = color.rgb2lab(target/255.)
-        lab_data[i] = lab.mean(axis=(0,1))
-
-    df = pd.DataFrame(rgb_data, columns=['R','G','B'])
-    df.insert(0,'Concentration', concentrations)
-    df[['Bg_R','Bg_G','Bg_B']] = rgb_bg
-    df[['L*','a*','b*']] = lab_data
+    worker = partial(calibration_means, target_roi=args.target_roi, background_roi=args.background_roi)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+        for i, (rgb, bg, lab) in enumerate(ex.map(worker, image_paths)):
+            rgb_data[i] = rgb
+            rgb_bg[i]   = bg
+            lab_data[i] = lab
+
+    df = pd.DataFrame({'Concentration': concentrations,
+                       'R': rgb_data[:,0], 'G': rgb_data[:,1], 'B': rgb_data[:,2],
+                       'Bg_R': rgb_bg[:,0], 'Bg_G': rgb_bg[:,1], 'Bg_B': rgb_bg[:,2],
+                       'L*': lab_data[:,0], 'a*': lab_data[:,1], 'b*': lab_data[:,2]})
     df.to_csv(os.path.join(args.output_folder,'calibration_data.csv'), index=False)
 
-    # absorbance
-    absorb = np.log10((rgb_bg + 1e-6)/(rgb_data + 1e-6))
+    # absorbance, computed in place in a single buffer
+    absorb = np.add(rgb_bg, 1e-6)
+    np.divide(absorb, rgb_data + 1e-6, out=absorb)
+    np.log10(absorb, out=absorb)
+
+    fig, ax = plt.subplots(figsize=(8,5))
 
     def plot(y, labels, title, fname, ylabel):
-        plt.figure(figsize=(8,5))
+        ax.clear()
         for idx, label in enumerate(labels):
-            plt.plot(concentrations, y[:,idx], marker='o', label=label)
-        plt.xlabel('Concentration')
-        plt.ylabel(ylabel)
-        plt.title(title)
-        plt.xticks(rotation=45)
-        plt.legend()
-        plt.tight_layout(); plt.savefig(os.path.join(args.output_folder, fname))
+            ax.plot(concentrations, y[:,idx], marker='o', label=label)
+        ax.set_xlabel('Concentration')
+        ax.set_ylabel(ylabel)
+        ax.set_title(title)
+        ax.tick_params(axis='x', labelrotation=45)
+        ax.legend()
+        fig.tight_layout(); fig.savefig(os.path.join(args.output_folder, fname))
 
     plot(rgb_data, ['R','G','B'], 'RGB Intensity vs Concentration', 'rgb_intensity.png', 'Intensity')
     plot(lab_data, ['L*','a*','b*'], 'LAB Intensity vs Concentration', 'lab_intensity.png', 'LAB')
     plot(absorb,  ['R','G','B'], 'Absorbance vs Concentration', 'absorbance.png', 'Absorbance')
+    plt.close(fig)
     print(f"Calibration complete. Results in {args.output_folder}")
 
 
+def process_dye(sub, curve, roi, hit_threshold, output_folder, cache_dir=None, threads=None):
+    # one dye folder end to end; takes only picklable arguments so it can run in a worker process.
+    # threads caps this process's decode pool and Numba kernel so parallel dye workers do not oversubscribe
+    threads = threads or (os.cpu_count() or 1)
+    if njit is not None:
+        numba.set_num_threads(min(threads, numba.config.NUMBA_NUM_THREADS))
+    dye = os.path.basename(sub)
+    paths = list_images(sub)
+    names = [os.path.basename(p) for p in paths]
+    stack = load_roi_stack(paths, roi, cache_dir, max_workers=min(MAX_WORKERS, threads))
+
+    # reduce the ROIs and apply the calibration curve to the whole folder at once
+    if curve is not None:
+        chan, idx, slope, intercept, is_dye4 = curve
+        means_arr, concs = reduce_and_calibrate(stack, idx, slope, intercept, is_dye4)
+    else:
+        means_arr = stack.mean(axis=(1,2))
+        concs = np.full(len(paths), np.nan)
+
+    df = pd.DataFrame({'Filename': names, 'R': means_arr[:,0], 'G': means_arr[:,1], 'B': means_arr[:,2],
+                       'Concentration': np.round(concs,3),
+                       'Hit': np.where(concs < hit_threshold, 'Hit', '')})
+    out_csv = os.path.join(output_folder, f"{dye}_results.csv")
+    df.to_csv(out_csv, index=False)
+
+    # plot the calibrated channel; folders without a calibration curve have nothing to plot
+    if curve is not None:
+        fig, ax = plt.subplots(figsize=(6,4))
+        ax.scatter(means_arr[:, idx], df['Concentration'].fillna(0))
+        ax.set_xlabel(f"{chan} intensity")
+        ax.set_ylabel("Concentration")
+        ax.set_title(f"{dye} Analysis")
+        fig.tight_layout(); fig.savefig(os.path.join(output_folder,f"{dye}_plot.png"))
+        plt.close(fig)
+    return dye, out_csv
+
+
 def analyze(args):
     with open(args.calibration_json) as f:
         cal = json.load(f)
+    # resolve every curve to (channel, channel index, slope, intercept, is_dye4) once, up front
+    curves = {dye: (c['channel'].upper(), {'R':0,'G':1,'B':2}[c['channel'].upper()],
+                    float(c['slope']), float(c['intercept']), dye == 'dye4')
+              for dye, c in cal.items()}
 
     folders = [d for d in glob(os.path.join(args.data_folder,'*')) if os.path.isdir(d)]
     os.makedirs(args.output_folder, exist_ok=True)
 
-    for sub in folders:
-        dye = os.path.basename(sub)
-        paths = glob(os.path.join(sub,'*.jpg'))
-        results = []
-        rgb_vals = []
-        for p in paths:
-            img = cv2.imread(p)
-            img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            x,y,w,h = args.roi
-            region = img_rgb[y:y+h, x:x+w]
-            means = region.mean(axis=(0,1))
-            rgb_vals.append(means)
-            chan = cal[dye]['channel'].upper()
-            idx = {'R':0,'G':1,'B':2}[chan]
-            if dye in cal and idx is not None:
-                slope = cal[dye]['slope']
-                intercept = cal[dye]['intercept']
-                if dye == 'dye4':
-                    conc = -np.log(means[idx]/intercept)/slope
-                else:
-                    conc = (intercept - means[idx]) / slope
-            else:
-                conc = np.nan
-            hit = 'Hit' if conc < args.hit_threshold else ''
-            results.append({'Filename': os.path.basename(p), 'R':means[0],'G':means[1],'B':means[2],
-                            'Concentration': round(conc,3), 'Hit': hit})
-
-        df = pd.DataFrame(results)
-        out_csv = os.path.join(args.output_folder, f"{dye}_results.csv")
-        df.to_csv(out_csv, index=False)
-
-        # plot
-        vals = np.array([r[['R','G','B']][cal[dye]['channel'].upper()] for r in results])
-        concs = df['Concentration'].fillna(0)
-        plt.figure(figsize=(6,4))
-        plt.scatter(vals, concs)
-        plt.xlabel(f"{cal[dye]['channel'].upper()} intensity")
-        plt.ylabel("Concentration")
-        plt.title(f"{dye} Analysis")
-        plt.tight_layout(); plt.savefig(os.path.join(args.output_folder,f"{dye}_plot.png"))
-        plt.close()
-        print(f"Processed {dye}, results: {out_csv}")
+    # dye folders are independent, so each one runs in its own process
+    # and gets an equal share of the cores for its own threads
+    n_procs = max(1, min(len(folders), os.cpu_count() or 1))
+    worker = partial(process_dye, roi=args.roi, hit_threshold=args.hit_threshold,
+                     output_folder=args.output_folder, cache_dir=args.cache_dir,
+                     threads=max(1, (os.cpu_count() or 1) // n_procs))
+    with ProcessPoolExecutor(max_workers=n_procs) as ex:
+        for dye, out_csv in ex.map(worker, folders, [curves.get(os.path.basename(d)) for d in folders]):
+            print(f"Processed {dye}, results: {out_csv}")
 
 
 def main():
@@ -177,6 +388,7 @@ def main():
     p_ana.add_argument('--roi', type=parse_roi, required=True)
     p_ana.add_argument('--hit-threshold', type=float, default=1.0)
     p_ana.add_argument('--output-folder', required=True)
+    p_ana.add_argument('--cache-dir', default=None)
     p_ana.set_defaults(func=analyze)
 
     args = parser.parse_args()
@@ -7,27 +7,39 @@
 
 import cv2
 import numpy as np
+import matplotlib
+matplotlib.use('Agg')  # plots are saved to disk, not shown
 import matplotlib.pyplot as plt
 from skimage import color
 import os
 import re
 import pandas as pd
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
 
 # Define root folder
 root_folder = r"C:\d+(?:\.\d+)?"
 
-# Define correlation functions for each dye type
+# Calibration curve for each dye type: (focus channel, slope, intercept, kind)
+# Channel index: 1 = Green (dye6-dye3), 2 = Blue (dye2-dye1)
+FORMULAS = {
+    'dye6': (1, 2.1853, 160.16, 'linear'),
+    'dye5': (1, 9.5192, 156.91, 'linear'),
+    'dye4': (1, 50.58, 151.4, 'exp'),
+    'dye3': (1, 3.3036, 162.51, 'linear'),
+    'dye2': (2, 5.8655, 165.77, 'linear'),
+    'dye1': (2, 2.8291, 164.37, 'linear'),
+}
+
+# Apply the calibration curve of a dye type (works on scalars and NumPy arrays)
 def calculate_concentration(rgb_value, dye_type):
-    correlation_map = {
-        'dye6': lambda v: (160.16 - v) / 2.1853,
-        'dye5': lambda v: (156.91 - v) / 9.5192,
-        'dye4': lambda v: np.exp((151.4 - v) / 50.58),
-        'dye3': lambda v: (162.51 - v) / 3.3036,
-        'dye2': lambda v: (165.77 - v) / 5.8655,
-        'dye1': lambda v: (164.37 - v) / 2.8291,
-    }
-    return correlation_map.get(dye_type, lambda v: None)(rgb_value)
+    if dye_type not in FORMULAS:
+        return None
+    _, slope, intercept, kind = FORMULAS[dye_type]
+    if kind == 'exp':
+        return np.exp((intercept - rgb_value) / slope)
+    return (intercept - rgb_value) / slope
 
 # Function to extract numerical values from filenames
 def numerical_sort_key(path):
@@ -35,8 +47,25 @@ def numerical_sort_key(path):
     match = re.search(r"(\d+(\.\d+)?)", filename)
     return float(match.group(1)) if match else float('inf')
 
+# Bounding box (x0, y0, x1, y1) around both ROIs, used for the debug crop
+def roi_debug_window(target_roi, background_roi):
+    x0 = min(target_roi[0], background_roi[0])
+    y0 = min(target_roi[1], background_roi[1])
+    x1 = max(target_roi[0] + target_roi[2], background_roi[0] + background_roi[2])
+    y1 = max(target_roi[1] + target_roi[3], background_roi[1] + background_roi[3])
+    return x0, y0, x1, y1
+
+# Draw both ROIs on an owned copy of the debug crop whose top-left corner is (x0, y0), and save it
+# (runs on the debug writer thread)
+def save_roi_debug_image(img_display, x0, y0, target_roi, background_roi, out_path):
+    cv2.rectangle(img_display, (target_roi[0] - x0, target_roi[1] - y0), (target_roi[0] - x0 + target_roi[2], target_roi[1] - y0 + target_roi[3]), (255, 0, 0), 2)
+    cv2.rectangle(img_display, (background_roi[0] - x0, background_roi[1] - y0), (background_roi[0] - x0 + background_roi[2], background_roi[1] - y0 + background_roi[3]), (0, 255, 0), 2)
+    if not cv2.imwrite(out_path, img_display):
+        raise IOError(f"Could not write {out_path}")
+
 # Function to process images in a given folder
-def process_images_in_folder(subfolder_path, save_folder):
+# If debug_writer (a ThreadPoolExecutor) is given, ROI-annotated crops are written to <save_folder>/roi_debug
+def process_images_in_folder(subfolder_path, save_folder, debug_writer=None):
     image_paths = sorted(glob(os.path.join(subfolder_path, '*.jpg')), key=numerical_sort_key)
     num_files = len(image_paths)
     folder_name = os.path.basename(subfolder_path)
@@ -54,11 +83,20 @@ def process_images_in_folder(subfolder_path, save_folder):
     target_roi = (872, 656, 50, 50)
     background_roi = (1164, 585, 38, 38)
 
+    # Focused channel for this dye (Blue for unknown folders)
+    focus_channel = FORMULAS[folder_name][0] if folder_name in FORMULAS else 2
+
     # Initialize arrays for storing values
     rgb_data = np.zeros((num_files, 3))
     calculated_concentrations = []
     hit_column = []
 
+    debug_jobs = []
+    if debug_writer is not None:
+        debug_folder = os.path.join(save_folder, "roi_debug")
+        os.makedirs(debug_folder, exist_ok=True)
+        x0, y0, x1, y1 = roi_debug_window(target_roi, background_roi)
+
     # Process images
     for k, file_path in enumerate(image_paths):
         img = cv2.imread(file_path)
@@ -68,21 +106,19 @@ def process_images_in_folder(subfolder_path, save_folder):
 
         img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
         target_region = img_rgb[target_roi[1]:target_roi[1]+target_roi[3], target_roi[0]:target_roi[0]+target_roi[2]]
-        
-        # Make a copy of the original image (BGR format) for visualization
-        img_display = img.copy()
-        cv2.rectangle(img_display, (target_roi[0], target_roi[1]), (target_roi[0] + target_roi[2], target_roi[1] + target_roi[3]), (255, 0, 0), 2)
-        cv2.rectangle(img_display, (background_roi[0], background_roi[1]), (background_roi[0] + background_roi[2], background_roi[1] + background_roi[3]), (0, 255, 0), 2)
-        cv2.imshow(f"ROI - {os.path.basename(file_path)}", img_display)
-        cv2.waitKey(0)
-        cv2.destroyAllWindows()
+
+        # Save the ROI check image in the background so the loop never waits on disk;
+        # only a copy of the small crop is queued, not the full frame
+        if debug_writer is not None:
+            img_display = img[y0:y1, x0:x1].copy()
+            debug_jobs.append(debug_writer.submit(save_roi_debug_image, img_display, x0, y0, target_roi, background_roi,
+                                                  os.path.join(debug_folder, os.path.basename(file_path))))
         
         # Compute mean RGB
         rgb_means = np.mean(target_region, axis=(0, 1))
         rgb_data[k, :] = rgb_means
 
         # Calculate concentration based on focused channel (Green for dye6-dye3, Blue for dye2-dye1)
-        focus_channel = 1 if folder_name in ['dye6', 'dye5', 'dye4', 'dye3'] else 2
         concentration = calculate_concentration(rgb_means[focus_channel], folder_name)
         
         if concentration < 1:
@@ -94,6 +130,10 @@ def process_images_in_folder(subfolder_path, save_folder):
         
         print(f"📸 Processed image {k + 1}/{num_files}: {os.path.basename(file_path)}")
 
+    # Surface any error raised on the debug writer thread
+    for job in debug_jobs:
+        job.result()
+
     print("\n🚀 Processing complete, saving data...")
     
     # Create DataFrame and save CSV
@@ -118,13 +158,21 @@ def process_images_in_folder(subfolder_path, save_folder):
     plt.title(f"Concentration vs. Focused Channel - {folder_name}", fontsize=18)
     plt.grid()
     plt.savefig(os.path.join(save_folder, "concentration_vs_channel_plot.png"))
-    plt.show()
+    plt.close()
 
 # Main processing
+parser = argparse.ArgumentParser()
+parser.add_argument('--debug', action='store_true', help="save ROI-annotated images to <subfolder>/roi_debug")
+args = parser.parse_args()
+debug_writer = ThreadPoolExecutor(max_workers=1) if args.debug else None
+
 subfolders = [f.path for f in os.scandir(root_folder) if f.is_dir()]
 
 for subfolder in subfolders:
     print(f"🔍 Processing subfolder: {subfolder}")
-    process_images_in_folder(subfolder, subfolder)
+    process_images_in_folder(subfolder, subfolder, debug_writer)
+
+if debug_writer is not None:
+    debug_writer.shutdown(wait=True)
 
 print("✅ All processing completed!")